@@ -1,17 +1,138 @@
 import concurrent.futures
-from typing import Any, Dict, List, Optional, Tuple
-
+import hashlib
+import io
+import itertools
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import closing
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import orjson
 import pandas as pd
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_URL = "https://gateway.edsn.nl/eancodeboek/v1/ecbinfoset"
 PRODUCTS = ["ELK", "GAS"]
-MAX_WORKERS = 10
-REQUEST_TIMEOUT_SECONDS = 10
+PRODUCT_SORT_ORDER = {product: index for index, product in enumerate(PRODUCTS)}
+CONNECT_TIMEOUT_SECONDS = 3.05
+READ_TIMEOUT_SECONDS = 15
+CONNECTION_POOL_SIZE = 32
+MAX_WORKERS = CONNECTION_POOL_SIZE
+CACHE_TTL_SECONDS = 3600
+CACHE_MAX_ENTRIES = 8192
+DISK_CACHE_PATH = ".ean_cache.sqlite3"
+DISK_CACHE_TTL_SECONDS = 30 * 24 * 3600
+DISK_CACHE_VERSION = "v1"
+DISK_CACHE_TIMEOUT_SECONDS = 5
+DISK_CACHE_MAX_ENTRIES = 100_000
+DISK_CACHE_PRUNE_INTERVAL = 1000
+PROGRESS_UPDATE_INTERVAL = 50
+PREVIEW_ROWS = 200
+ADDRESS_COLUMNS = ["postalCode", "streetNumber", "streetNumberAddition"]
+RESULT_COLUMNS = [
+    "postalCode",
+    "streetNumber",
+    "streetNumberAddition",
+    "bagId",
+    "product",
+    "ean",
+    "specialMeteringPoint",
+]
 
-MeteringRecord = Dict[str, Any]
 AddressKey = Tuple[str, int, Optional[str]]
+MeteringRecord = Tuple[
+    str,
+    int,
+    Optional[str],
+    Optional[str],
+    Optional[str],
+    Optional[str],
+    Optional[bool],
+]
+
+
+@dataclass
+class ResultBuffers:
+    """Column-wise buffers that collect the metering data result table."""
+
+    postal_codes: List[str] = field(default_factory=list)
+    street_numbers: List[int] = field(default_factory=list)
+    additions: List[Optional[str]] = field(default_factory=list)
+    bag_ids: List[Optional[str]] = field(default_factory=list)
+    products: List[Optional[str]] = field(default_factory=list)
+    eans: List[Optional[str]] = field(default_factory=list)
+    special: List[Optional[bool]] = field(default_factory=list)
+
+    def columns(self) -> List[List[Any]]:
+        """Return the column buffers in RESULT_COLUMNS order."""
+        return [
+            self.postal_codes,
+            self.street_numbers,
+            self.additions,
+            self.bag_ids,
+            self.products,
+            self.eans,
+            self.special,
+        ]
+
+    def extend(self, records: List[MeteringRecord]) -> None:
+        """Append formatted records to the buffers column by column."""
+        for column, values in zip(self.columns(), zip(*records)):
+            column.extend(values)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Build the result DataFrame directly from the column buffers."""
+        return pd.DataFrame(dict(zip(RESULT_COLUMNS, self.columns())))
+
+
+@st.cache_resource
+def create_session() -> requests.Session:
+    """Create a pooled HTTP session that retries transient API failures.
+
+    Cached as a resource, so the session and its connection pool survive
+    Streamlit reruns instead of being rebuilt on every script execution.
+    """
+    session = requests.Session()
+    session.headers.update(
+        {
+            "Accept": "application/json",
+            "User-Agent": "ean-code-retriever/1.0",
+        }
+    )
+
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=CONNECTION_POOL_SIZE,
+        pool_maxsize=CONNECTION_POOL_SIZE,
+        max_retries=retry,
+    )
+    session.mount("https://", adapter)
+
+    return session
+
+
+class CsvValidationError(ValueError):
+    """Raised when the uploaded CSV cannot be used to look up addresses."""
+
+    def __init__(
+        self,
+        message: str,
+        invalid_rows: Optional[pd.DataFrame] = None,
+    ) -> None:
+        super().__init__(message)
+        self.invalid_rows = invalid_rows
 
 
 def main() -> None:
@@ -27,21 +148,75 @@ def main() -> None:
 
     if uploaded_file:
         try:
-            df = pd.read_csv(uploaded_file)
-        except Exception as error:
-            st.error(f"Could not read CSV file: {error}")
+            df = load_addresses(uploaded_file.getvalue())
+        except CsvValidationError as error:
+            st.error(str(error))
+            if error.invalid_rows is not None:
+                st.dataframe(error.invalid_rows)
             return
 
-        validate_and_process_csv(df)
+        updated_df, missing_addresses, request_errors = build_results(df)
+        display_results(updated_df, missing_addresses, request_errors)
+
 
+@st.cache_data(show_spinner=False)
+def load_addresses(file_bytes: bytes) -> pd.DataFrame:
+    """Parse and validate an uploaded CSV file.
+
+    Cached on the file contents, so Streamlit reruns for the same upload
+    skip parsing and validation. The API lookups are not cached here: they
+    are memoized per address in fetch_metering_points, which only caches
+    successful requests, so failed lookups are retried on the next upload.
+    The download button does not trigger a rerun, so downloading results
+    never repeats the lookups.
+    """
+    try:
+        df = pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+    except Exception as error:
+        raise CsvValidationError(f"Could not read CSV file: {error}") from error
+
+    return validate_csv(df)
+
+
+def build_results(
+    df: pd.DataFrame,
+) -> Tuple[pd.DataFrame, List[AddressKey], List[str]]:
+    """Retrieve metering data for the validated addresses."""
+    metering_data, missing_addresses, request_errors = process_rows(df)
 
-def validate_and_process_csv(df: pd.DataFrame) -> None:
-    """Validate and process the uploaded CSV file."""
+    updated_df = metering_data.to_dataframe()
+    updated_df["streetNumberAddition"] = updated_df["streetNumberAddition"].fillna("")
+
+    updated_df.sort_values(
+        by=["postalCode", "streetNumber", "streetNumberAddition", "product"],
+        key=sort_key,
+        inplace=True,
+    )
+    updated_df.reset_index(drop=True, inplace=True)
+
+    return updated_df, missing_addresses, request_errors
+
+
+def sort_key(column: pd.Series) -> pd.Series:
+    """Sort products by their position in PRODUCTS, unknown products last.
+
+    Products are mapped to integer codes only for sorting, so values outside
+    PRODUCTS keep their original text in the table and downloaded CSV.
+    """
+    if column.name == "product":
+        return column.map(PRODUCT_SORT_ORDER)
+
+    return column
+
+
+def validate_csv(df: pd.DataFrame) -> pd.DataFrame:
+    """Validate the uploaded CSV file and normalize its address columns."""
     required_columns = {"postalCode", "streetNumber"}
 
     if not required_columns.issubset(df.columns):
-        st.error(f"CSV must contain at least the columns: {sorted(required_columns)}")
-        return
+        raise CsvValidationError(
+            f"CSV must contain at least the columns: {sorted(required_columns)}"
+        )
 
     df = df.copy()
 
@@ -57,9 +232,10 @@ def validate_and_process_csv(df: pd.DataFrame) -> None:
 
     invalid_rows = df[df["streetNumber"].isna()]
     if not invalid_rows.empty:
-        st.error("Some streetNumber values are invalid or missing.")
-        st.dataframe(invalid_rows)
-        return
+        raise CsvValidationError(
+            "Some streetNumber values are invalid or missing.",
+            invalid_rows,
+        )
 
     df["streetNumber"] = df["streetNumber"].astype(int)
 
@@ -72,30 +248,39 @@ def validate_and_process_csv(df: pd.DataFrame) -> None:
     else:
         df["streetNumberAddition"] = pd.NA
 
-    metering_data, missing_addresses = process_rows(df)
+    return df
+
+
+def display_results(
+    updated_df: pd.DataFrame,
+    missing_addresses: List[AddressKey],
+    request_errors: List[str],
+) -> None:
+    """Show the metering data and warnings for addresses without results."""
+    if request_errors:
+        st.warning(
+            "Some API requests failed:\n"
+            + "\n".join(f"- {request_error}" for request_error in request_errors)
+        )
 
     if missing_addresses:
-        for postal_code, street_number, street_number_addition in missing_addresses:
+        lines = []
+        for address_key in dict.fromkeys(missing_addresses):
+            postal_code, street_number, street_number_addition = address_key
             addition_text = (
                 f" {street_number_addition}" if street_number_addition else ""
             )
-            st.warning(
-                f"No ELK or GAS metering points found for postal code "
-                f"{postal_code} and street number {street_number}{addition_text}"
-            )
+            lines.append(f"- {postal_code} {street_number}{addition_text}")
 
-    if not metering_data:
+        st.warning(
+            "No ELK or GAS metering points found for these addresses:\n"
+            + "\n".join(lines)
+        )
+
+    if updated_df.empty:
         st.info("No metering data found.")
         return
 
-    updated_df = pd.DataFrame(metering_data)
-
-    updated_df.sort_values(
-        by=["postalCode", "streetNumber", "streetNumberAddition", "product"],
-        inplace=True,
-    )
-    updated_df.reset_index(drop=True, inplace=True)
-
     st.subheader("Metering Data")
     st.dataframe(updated_df, use_container_width=True)
 
@@ -104,107 +289,139 @@ def validate_and_process_csv(df: pd.DataFrame) -> None:
 
 def process_rows(
     df: pd.DataFrame,
-) -> Tuple[List[MeteringRecord], List[AddressKey]]:
+) -> Tuple[ResultBuffers, List[AddressKey], List[str]]:
     """Process each row and retrieve metering data concurrently."""
-    metering_data: List[MeteringRecord] = []
+    metering_data = ResultBuffers()
     missing_addresses: List[AddressKey] = []
+    request_errors: List[str] = []
+    failed_addresses = set()
 
-    tasks = []
+    address_keys = get_address_keys(df)
+    unique_address_keys = get_address_keys(df.drop_duplicates(subset=ADDRESS_COLUMNS))
 
     progress_bar = st.progress(0)
-    total_addresses = len(df)
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        for _, row in df.iterrows():
-            street_number_addition = normalize_optional_value(
-                row.get("streetNumberAddition")
+    preview_placeholder = st.empty()
+    total_addresses = len(unique_address_keys)
+
+    records_by_address: Dict[AddressKey, List[MeteringRecord]] = {}
+    preview_records: Deque[MeteringRecord] = deque(maxlen=PREVIEW_ROWS)
+
+    for completed_addresses, (address_key, metering_points, errors) in enumerate(
+        get_metering_points_bulk(unique_address_keys),
+        start=1,
+    ):
+        if errors:
+            request_errors.extend(errors)
+            failed_addresses.add(address_key)
+
+        postal_code, street_number, _ = address_key
+        records = format_metering_points(postal_code, street_number, metering_points)
+        records_by_address[address_key] = records
+        preview_records.extend(records)
+
+        if (
+            completed_addresses % PROGRESS_UPDATE_INTERVAL == 0
+            or completed_addresses == total_addresses
+        ):
+            progress_bar.progress(completed_addresses / total_addresses)
+            preview_placeholder.dataframe(
+                pd.DataFrame.from_records(
+                    list(preview_records), columns=RESULT_COLUMNS
+                ),
+                use_container_width=True,
             )
 
-            address_key: AddressKey = (
-                row["postalCode"],
-                row["streetNumber"],
-                street_number_addition,
-            )
+    preview_placeholder.empty()
 
-            futures = [
-                executor.submit(
-                    process_product,
-                    row,
-                    product,
-                    street_number_addition,
-                )
-                for product in PRODUCTS
-            ]
-
-            tasks.append(
-                {
-                    "address": address_key,
-                    "futures": futures,
-                }
-            )
+    for address_key in address_keys:
+        records = records_by_address[address_key]
 
-        completed_addresses = 0
+        if records:
+            metering_data.extend(records)
+        elif address_key not in failed_addresses:
+            missing_addresses.append(address_key)
 
-        for task in tasks:
-            result_data: List[MeteringRecord] = []
+    return metering_data, missing_addresses, request_errors
 
-            for future in concurrent.futures.as_completed(task["futures"]):
-                try:
-                    result = future.result()
-                except Exception as error:
-                    st.warning(f"Could not process one request: {error}")
-                    result = []
 
-                if result:
-                    result_data.extend(result)
+def get_address_keys(df: pd.DataFrame) -> List[AddressKey]:
+    """Build the normalized address key for every row."""
+    street_number_addition = df["streetNumberAddition"]
+    street_number_additions = (
+        street_number_addition.astype(object)
+        .where(street_number_addition.notna(), None)
+        .tolist()
+    )
 
-            if result_data:
-                metering_data.extend(result_data)
-            else:
-                missing_addresses.append(task["address"])
+    return list(
+        zip(
+            df["postalCode"].tolist(),
+            df["streetNumber"].tolist(),
+            street_number_additions,
+        )
+    )
 
-            completed_addresses += 1
-            progress_bar.progress(completed_addresses / total_addresses)
 
-    return metering_data, missing_addresses
+def get_metering_points_bulk(
+    address_keys: List[AddressKey],
+) -> Iterator[Tuple[AddressKey, List[Dict[str, Any]], List[str]]]:
+    """Fetch metering points of all products for many addresses.
+
+    The EDSN API only accepts a single address and product per request, so
+    the requests are fanned out over a thread pool sharing the HTTP session.
+    Results are yielded per address as soon as all of its products are in,
+    together with the error messages of any failed requests. Errors are
+    returned rather than shown because worker threads cannot render
+    Streamlit elements.
+    """
+    work_items = [
+        (address_key, product) for address_key in address_keys for product in PRODUCTS
+    ]
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(fetch_work_item, work_items)
 
-def process_product(
-    row: pd.Series,
-    product: str,
-    street_number_addition: Optional[str],
-) -> List[MeteringRecord]:
-    """Process one product type for a given address."""
-    metering_points = get_metering_points(
-        product=product,
-        postal_code=row["postalCode"],
-        street_number=row["streetNumber"],
-        street_number_addition=street_number_addition,
-    )
+        for address_key in address_keys:
+            metering_points: List[Dict[str, Any]] = []
+            errors: List[str] = []
+
+            for result, error in itertools.islice(results, len(PRODUCTS)):
+                metering_points.extend(result)
+
+                if error:
+                    errors.append(error)
+
+            yield address_key, metering_points, errors
 
-    if not metering_points:
-        return []
 
-    return format_metering_points(row, metering_points)
+def fetch_work_item(
+    work_item: Tuple[AddressKey, str],
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Fetch metering points for one (address, product) work item."""
+    address_key, product = work_item
+
+    try:
+        return get_metering_points(product, *address_key)
+    except Exception as error:
+        return [], f"Could not process one request: {error}"
 
 
 def format_metering_points(
-    row: pd.Series,
+    postal_code: str,
+    street_number: int,
     metering_points: List[Dict[str, Any]],
 ) -> List[MeteringRecord]:
-    """Format retrieved metering points into structured records."""
+    """Format retrieved metering points into result records."""
     return [
-        {
-            "postalCode": row["postalCode"],
-            "streetNumber": row["streetNumber"],
-            "streetNumberAddition": meter_point.get("address", {}).get(
-                "streetNumberAddition"
-            ),
-            "bagId": meter_point.get("bagId"),
-            "product": meter_point.get("product"),
-            "ean": meter_point.get("ean"),
-            "specialMeteringPoint": meter_point.get("specialMeteringPoint"),
-        }
+        (
+            postal_code,
+            street_number,
+            meter_point.get("address", {}).get("streetNumberAddition"),
+            meter_point.get("bagId"),
+            meter_point.get("product"),
+            meter_point.get("ean"),
+            meter_point.get("specialMeteringPoint"),
+        )
         for meter_point in metering_points
     ]
 
@@ -214,62 +431,225 @@ def get_metering_points(
     postal_code: str,
     street_number: int,
     street_number_addition: Optional[str] = None,
-) -> Optional[List[Dict[str, Any]]]:
-    """Fetch metering points from the API."""
-    params: Dict[str, Any] = {
-        "product": product,
-        "postalCode": postal_code,
-        "streetNumber": street_number,
-    }
-
-    if street_number_addition:
-        params["streetNumberAddition"] = street_number_addition
-
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Fetch metering points from the API, returning failures as a message."""
     try:
-        response = requests.get(
-            API_URL,
-            params=params,
-            timeout=REQUEST_TIMEOUT_SECONDS,
+        metering_points = fetch_metering_points(
+            product,
+            postal_code,
+            street_number,
+            street_number_addition,
         )
-        response.raise_for_status()
-        return response.json().get("meteringPoints", [])
+        return metering_points, None
 
     except requests.RequestException as error:
-        st.warning(
+        return [], (
             f"API request failed for {postal_code} {street_number} ({product}): {error}"
         )
-        return None
 
     except ValueError as error:
-        st.warning(
+        return [], (
             f"Could not parse API response for {postal_code} {street_number} "
             f"({product}): {error}"
         )
-        return None
 
 
-def normalize_optional_value(value: Any) -> Optional[str]:
-    """Normalize optional CSV values such as street number additions."""
-    if pd.isna(value):
-        return None
+@st.cache_data(
+    ttl=CACHE_TTL_SECONDS,
+    max_entries=CACHE_MAX_ENTRIES,
+    show_spinner=False,
+)
+def fetch_metering_points(
+    product: str,
+    postal_code: str,
+    street_number: int,
+    street_number_addition: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Request metering points for one address and product.
+
+    Results are cached per address and product, in memory and on disk, so
+    duplicate addresses, Streamlit reruns and later sessions do not hit the
+    API again. Failures raise and are therefore never cached.
+    """
+    cache_key = disk_cache_key(
+        product,
+        postal_code,
+        street_number,
+        street_number_addition,
+    )
+    cached_metering_points = read_disk_cache(cache_key)
+
+    if cached_metering_points is not None:
+        return cached_metering_points
+
+    response = create_session().get(
+        build_url(product, postal_code, street_number, street_number_addition),
+        timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+    )
+    response.raise_for_status()
+    metering_points = orjson.loads(response.content).get("meteringPoints", [])
+
+    if metering_points:
+        write_disk_cache(cache_key, metering_points)
+
+    return metering_points
+
+
+def build_url(
+    product: str,
+    postal_code: str,
+    street_number: int,
+    street_number_addition: Optional[str] = None,
+) -> str:
+    """Build the API request URL without going through requests' params."""
+    url = (
+        f"{API_URL}?product={product}"
+        f"&postalCode={quote(postal_code, safe='')}"
+        f"&streetNumber={street_number}"
+    )
+
+    if street_number_addition:
+        url += f"&streetNumberAddition={quote(street_number_addition, safe='')}"
+
+    return url
 
-    value = str(value).strip()
 
-    if value == "":
+def disk_cache_key(
+    product: str,
+    postal_code: str,
+    street_number: int,
+    street_number_addition: Optional[str],
+) -> str:
+    """Build a short, versioned on-disk cache key for one API lookup."""
+    key = "|".join(
+        [
+            DISK_CACHE_VERSION,
+            product,
+            postal_code,
+            str(street_number),
+            street_number_addition or "",
+        ]
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+@st.cache_resource
+def init_disk_cache() -> threading.local:
+    """Create the SQLite cache schema once and hold per-thread connections.
+
+    WAL mode lets the lookup threads read while another thread writes.
+    """
+    with closing(sqlite3.connect(DISK_CACHE_PATH)) as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS metering_points "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        prune_disk_cache(connection)
+
+    return threading.local()
+
+
+@st.cache_resource
+def disk_cache_write_counter() -> Iterator[int]:
+    """Count disk cache writes so pruning runs every few writes."""
+    return itertools.count(1)
+
+
+def prune_disk_cache(connection: sqlite3.Connection) -> None:
+    """Delete expired entries and cap the cache at DISK_CACHE_MAX_ENTRIES.
+
+    When over the cap, the entries closest to expiry are dropped first.
+    """
+    with connection:
+        connection.execute(
+            "DELETE FROM metering_points WHERE expires_at <= ?",
+            (time.time(),),
+        )
+        connection.execute(
+            "DELETE FROM metering_points WHERE key IN ("
+            "SELECT key FROM metering_points ORDER BY expires_at DESC "
+            "LIMIT -1 OFFSET ?)",
+            (DISK_CACHE_MAX_ENTRIES,),
+        )
+
+
+def open_disk_cache() -> sqlite3.Connection:
+    """Return this thread's connection to the SQLite cache."""
+    connections = init_disk_cache()
+    connection = getattr(connections, "connection", None)
+
+    if connection is None:
+        connection = sqlite3.connect(
+            DISK_CACHE_PATH,
+            timeout=DISK_CACHE_TIMEOUT_SECONDS,
+        )
+        connections.connection = connection
+
+    return connection
+
+
+def read_disk_cache(key: str) -> Optional[List[Dict[str, Any]]]:
+    """Return cached metering points, or None when missing, expired or corrupt.
+
+    Entries that cannot be decoded are deleted, so the next lookup refetches
+    them from the API.
+    """
+    try:
+        connection = open_disk_cache()
+        row = connection.execute(
+            "SELECT value FROM metering_points WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        try:
+            return orjson.loads(row[0])
+        except orjson.JSONDecodeError:
+            with connection:
+                connection.execute(
+                    "DELETE FROM metering_points WHERE key = ?",
+                    (key,),
+                )
+            return None
+    except sqlite3.Error:
         return None
 
-    return value
+
+def write_disk_cache(key: str, metering_points: List[Dict[str, Any]]) -> None:
+    """Store metering points in the on-disk cache, ignoring cache failures."""
+    try:
+        with open_disk_cache() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO metering_points (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (
+                    key,
+                    orjson.dumps(metering_points),
+                    time.time() + DISK_CACHE_TTL_SECONDS,
+                ),
+            )
+
+        if next(disk_cache_write_counter()) % DISK_CACHE_PRUNE_INTERVAL == 0:
+            prune_disk_cache(connection)
+    except sqlite3.Error:
+        pass
 
 
 def download_csv(updated_df: pd.DataFrame) -> None:
     """Create a downloadable CSV file from the processed data."""
-    csv = updated_df.to_csv(index=False)
+    csv_buffer = io.BytesIO()
+    updated_df.to_csv(csv_buffer, index=False, encoding="utf-8")
+    csv_buffer.seek(0)
 
     st.download_button(
         "Download CSV",
-        data=csv,
+        data=csv_buffer,
         file_name="metering_data.csv",
         mime="text/csv",
+        on_click="ignore",
     )
 
 